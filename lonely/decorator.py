@@ -1,3 +1,4 @@
+import functools, sys, threading
 
 def invoke(func):
 	'''
@@ -46,11 +47,33 @@ def memoize(func):
 	...
 	>>> fib(10)
 	89
-	>>> # The dictionary of cached results can also be accessed directly.
-	>>> # The keys are argument tuples.
+	>>> # Cached results can also be looked up by argument tuple.
 	>>> fib.memo_dict[9,]
 	55
 
+	(a function like this, which only ever needs its previous two values,
+	is better still written as a loop; see ``tail_recursive``)
+
+	Note that ``memo_dict`` is not actually a dict, but a read-only view
+	of the cache.  Looking up an argument tuple that is not in the cache
+	computes and records its value rather than raising ``KeyError``, and
+	the view supports neither membership tests, iteration, nor assignment.
+
+	>>> (9,) in fib.memo_dict
+	Traceback (most recent call last):
+	    ...
+	TypeError: memo_dict does not support membership tests or iteration
+
+	Keyword arguments are supported as well, and become part of the key.
+	(so ``f(1, y=2)`` and ``f(1, 2)`` are cached separately)
+
+	>>> @memoize
+	... def power(x, exponent=2):
+	...     return x ** exponent
+	...
+	>>> power(3, exponent=3)
+	27
+
 	Tips:
 
 	``memoize`` can only be used when all arguments to a function are
@@ -115,15 +138,10 @@ def memoize(func):
 	>>> list(foo(3))
 	[0, 1, 0, 2, 0, 1, 0, 3, 0, 1, 0, 2, 0, 1, 0]
 	'''
-	lookup = {}
-
-	@functools.wraps(func)
-	def wrapped(*args):
-		if args not in lookup:
-			lookup[args] = func(*args)
-		return lookup[args]
-
-	wrapped.memo_dict = lookup
+	# functools.cache is implemented in C, so a cache hit never
+	#  enters the interpreter.
+	wrapped = functools.cache(func)
+	wrapped.memo_dict = _MemoView(wrapped, star=True)
 	wrapped.memo_func = func
 	return wrapped
 
@@ -131,21 +149,135 @@ def memoize_onevar(func):
 	'''
 	Decorator to memoize a function of one variable.
 
-	In some cases using this version can be up to twice as fast
-	as code using ``@memoize``.
+	This is the same as ``@memoize``, except that the keys of ``memo_dict``
+	are the argument itself rather than a 1-tuple.  (``memo_dict`` is a
+	read-only view with the same limitations described in ``memoize``)
+	'''
+	wrapped = functools.cache(func)
+	wrapped.memo_dict = _MemoView(wrapped, star=False)
+	wrapped.memo_func = func
+	return wrapped
+
+def memoize_njit(sig, cache=True):
 	'''
-	lookup = {}
+	Decorator to compile a function with numba's ``njit`` and memoize it.
 
-	@functools.wraps(func)
-	def wrapped(x):
-		if x not in lookup:
-			lookup[x] = func(x)
-		return lookup[x]
+	``sig`` is a numba signature (e.g. ``'int64(int64)'``), and ``cache`` is
+	forwarded to ``njit``. (pass ``cache=False`` for functions defined
+	interactively, which numba cannot cache to disk)
 
-	wrapped.memo_dict = lookup
-	wrapped.memo_func = func
+	The signature is required so that numba compiles the function immediately,
+	which lets it resolve recursive calls to itself.  (compiled lazily, the
+	function's name would by then refer to the memoized Python wrapper,
+	which numba cannot call)
+
+	Memoization happens at the Python call boundary; calls made from inside
+	compiled code (including recursive calls) go straight to the compiled
+	function and do not consult the cache.  Hence this is meant for functions
+	whose expensive part is a loop, and which get called repeatedly with the
+	same arguments.
+
+	>>> @memoize_njit('int64(int64)', cache=False)
+	... def sum_of_squares(n):
+	...     total = 0
+	...     for i in range(n):
+	...         total += i * i
+	...     return total
+	...
+	>>> sum_of_squares(1000)
+	332833500
+	>>> sum_of_squares.memo_dict[1000,]
+	332833500
+
+	Do NOT use it on naively recursive functions like the ``fib`` example
+	of ``memoize``; its recursive calls would not be memoized, and the
+	number of calls would grow exponentially.
+
+	>>> @memoize_njit('int64(int64)', cache=False) # doctest: +SKIP
+	... def fib(n):
+	...    return 1 if n < 2 else fib(n-1) + fib(n-2)
+	...
+	>>> fib(80) # takes practically forever  # doctest: +SKIP
+
+	If numba is not installed, this falls back to ``@memoize``, which *does*
+	memoize recursive calls.  (so the above ``fib`` would only be slow
+	when numba is present)
+	'''
+	def deco(func):
+		try: import numba
+		except ImportError: return memoize(func)
+		return memoize(numba.njit(sig, cache=cache)(func))
+	return deco
+
+class _MemoView:
+	'''
+	Stand-in for the ``memo_dict`` of a memoized function.
+
+	``functools.cache`` does not expose its dictionary, so looking up
+	a key simply calls the cached function (which computes and records
+	the value if it is missing).  Membership tests, iteration and
+	assignment can't be supported, and raise ``TypeError``.
+	'''
+	def __init__(self, cached, star):
+		(self._cached, self._star) = (cached, star)
+
+	def __getitem__(self, key):
+		return self._cached(*key) if self._star else self._cached(key)
+
+	def __setitem__(self, key, value):
+		raise TypeError('memo_dict does not support assignment')
+
+	# (defining these prevents python from falling back to the sequence
+	#  protocol, which would call __getitem__ with integer indices)
+	def __contains__(self, key):
+		raise TypeError('memo_dict does not support membership tests or iteration')
+
+	def __iter__(self):
+		raise TypeError('memo_dict does not support membership tests or iteration')
+
+	def __len__(self):
+		return self._cached.cache_info().currsize
+
+def tail_recursive(func):
+	'''
+	Decorator that runs a function's self-recursive tail calls in a loop.
+
+	Inside the function, a tail call to itself is written as
+	``return recurse(...)`` instead of ``return func(...)``. The decorated
+	function then evaluates it by looping, using constant stack space.
+
+	Example: The Fibonacci sequence, again. (compare with ``memoize``)
+	>>> @tail_recursive
+	... def fib(n, a=1, b=1):
+	...     return a if n == 0 else recurse(n-1, b, a+b)
+	...
+	>>> fib(10)
+	89
+	>>> # Far deeper than the recursion limit.
+	>>> fib(5000) > 0
+	True
+
+	Only a ``recurse(...)`` that is *returned* gets special treatment;
+	calling ``recurse`` anywhere else is a mistake.
+	'''
+	@functools.wraps(func)
+	def wrapped(*args, **kwargs):
+		while True:
+			result = func(*args, **kwargs)
+			if not isinstance(result, _TailCall):
+				return result
+			(args, kwargs) = (result.args, result.kwargs)
 	return wrapped
 
+def recurse(*args, **kwargs):
+	''' Make a tail call from a ``tail_recursive`` function. '''
+	return _TailCall(args, kwargs)
+
+class _TailCall:
+	__slots__ = ('args', 'kwargs')
+	def __init__(self, args, kwargs):
+		(self.args, self.kwargs) = (args, kwargs)
+
 def debug(file=sys.stderr):
 	'''
 	Intercept all calls to a function and print the input and output.
@@ -168,9 +300,11 @@ def debug(file=sys.stderr):
 
 # technically, if we just wanted to indent for a single function,  we could
 #  just use nonlocal to update a local 'indent' variable.
-# However, using a global allows mutually recursive functions to be debugged
-#  and "share" the indent level.
-_debug_rec__indent_level = 0
+# However, sharing the level between all functions allows mutually recursive
+#  functions to be debugged and "share" the indent level.
+# It is thread-local so that functions being debugged on different threads
+#  do not trample each other's indentation.
+_debug_rec__state = threading.local()
 def debug_rec(file=sys.stderr):
 	'''
 	Intercept all calls to a function and print the input and output in a
@@ -185,37 +319,36 @@ def debug_rec(file=sys.stderr):
 	def deco(func):
 		INDENT_CHARS = '  '
 		MAX_INDENT = 16
+		INDENTS = [INDENT_CHARS * i for i in range(MAX_INDENT + 1)]
+		state = _debug_rec__state
 
 		@functools.wraps(func)
 		def wrapped(*args, **kwargs):
-			global _debug_rec__indent_level # noqa
 			# need to save this to have any sensible way of restoring indentation properly
 			#  after hitting the max indent
-			savedlevel = _debug_rec__indent_level
-			indent = INDENT_CHARS * _debug_rec__indent_level
+			savedlevel = getattr(state, 'indent_level', 0)
+			indent = INDENTS[savedlevel]
 
-			_debug_rec__indent_level = min(MAX_INDENT, _debug_rec__indent_level+1)
+			state.indent_level = min(MAX_INDENT, savedlevel+1)
 
 			callstr = _format_call(func, *args, **kwargs)
 			print(indent + '%s:' % callstr, file=file)
 
 			try: result = func(*args, **kwargs)
 			except:
-				_debug_rec__indent_level = savedlevel
+				state.indent_level = savedlevel
 				print(indent + '%s failed horribly!' % callstr, file=file)
 				raise
 			else:
-				_debug_rec__indent_level = savedlevel
+				state.indent_level = savedlevel
 				print(indent + '%s = %r' % (callstr, result), file=file)
 			return result
 		return wrapped
 	return deco
 
 def _format_call(func, *args, **kwargs):
-	return '{}({}{}{})'.format(
-		func.__name__,
-		', '.join(repr(x) for x in args),
-		', ' if (args and kwargs) else '',
-		', '.join('%s=%r' % (k,v) for (k,v) in kwargs.items()),
-	)
+	args_str = ', '.join(map(repr, args))
+	kwargs_str = ', '.join(f'{k}={v!r}' for (k,v) in kwargs.items())
+	sep = ', ' if (args and kwargs) else ''
+	return f'{func.__name__}({args_str}{sep}{kwargs_str})'
 
@@ -1,4 +1,4 @@
-import argparse, sys, json
+import argparse, sys, json, functools
 
 class Spec:
 	def __init__(self, comment='#', gnu_order='dblw', json_order='dblw'):
@@ -11,6 +11,7 @@ class Spec:
 	def has_nontrivial_order(self): return self._gnu_order != self._arr_order
 
 	@staticmethod
+	@functools.lru_cache(maxsize=64)
 	def _solve_permutation(start, end):
 		start = list(start)
 		end = list(end)
@@ -22,71 +23,182 @@ class Spec:
 		if len(end)   != len(set(end)):   raise ValueError('{!r} has duplicates'.format(end))
 
 		d = {c:i for (i,c) in enumerate(start)}
-		out = [d[c] for c in end]
-		assert [start[i] for i in out] == end, "postcondition"
+		# (a tuple, since the result is shared between calls)
+		out = tuple(d[c] for c in end)
 		return out
 
-def dump(data, file, spec=Spec()):
+_DEFAULT_SPEC = Spec()
+
+def dump(data, file, spec=_DEFAULT_SPEC):
 	'''
-	Dump a quadruply-nested iterable of floats into a gnuplot data file.
+	Dump a quadruply-nested iterable (or 4D numpy array) of floats into a
+	gnuplot data file.
 
 	Data is separated by spaces, then line breaks, then blank lines,
 	and then double blank lines.
 	'''
-	print(dumps(data, spec=spec), file=file)
+	# write one block at a time rather than building the whole string
+	file.writelines(_dump_chunks(data, spec))
+	file.write('\n')
 
-def load(file, spec=Spec()):
+def load(file, spec=_DEFAULT_SPEC):
 	'''
 	Load a gnuplot data file into a quadruply-nested list.
 
 	Data is delimited by non-line-breaking whitespace, then line breaks,
 	then blank lines, and then double blank lines.
+
+	>>> loads('1 2\\n3 4\\n\\n5 6\\n\\n\\n7 8\\n')
+	[[[[1.0, 2.0], [3.0, 4.0]], [[5.0, 6.0]]], [[[7.0, 8.0]]]]
+
+	Any run of two or more blank lines separates index blocks, and blank
+	lines at the beginning or end of the file are ignored.
+
+	>>> loads('\\n\\n1\\n\\n\\n\\n2\\n\\n\\n\\n\\n3\\n\\n')
+	[[[[1.0]]], [[[2.0]]], [[[3.0]]]]
+
+	Comment lines are dropped entirely, so they neither count as blank
+	lines nor interrupt a run of them.
+
+	>>> loads('# header\\n1\\n# note\\n2\\n\\n# note\\n\\n3\\n')
+	[[[[1.0], [2.0]]], [[[3.0]]]]
 	'''
-	# Split to identify comment lines
-	# (defined by gnuplot as a line whose first nonblank is some specified delimiter)
-	lines = [line.strip() for line in file]
-	if spec._comment:
-		lines = [line for line in lines if not line.startswith(spec._comment)]
-
-	# used to filter out empty blocks that split() may produce at the beginning or end
-	WHITESPACE = set(' \n\r\t')
-	def is_blank(s):
-		return not bool(set(s) - WHITESPACE)
-
-	# Rejoin to identify blank line sequences.
-	concat = '\n'.join(lines)
-	data = [[[[float(x) for x in line.split()]
-		for line in block.split('\n')]
-		for block in index_block.split('\n\n') if not is_blank(block)]
-		for index_block in concat.split('\n\n\n') if not is_blank(index_block)]
+	# (startswith on an empty tuple is always False)
+	comments = (spec._comment,) if spec._comment else ()
+	data = []
+	blank_run = 0 # number of blank lines since the last row
+	for line in file:
+		line = line.strip()
+		if not line:
+			blank_run += 1
+			continue
+		# Comment lines are skipped without interrupting a run of blank lines.
+		# (gnuplot defines them as lines whose first nonblank is some specified delimiter)
+		if line.startswith(comments):
+			continue
+
+		if not data or blank_run >= 2:
+			data.append([])
+		if not data[-1] or blank_run:
+			data[-1].append([])
+		data[-1][-1].append(list(map(float, line.split())))
+		blank_run = 0
 
 	if spec.has_nontrivial_order():
-		import numpy
-		data = numpy.transpose(data, spec._gnu_to_arr).tolist()
+		data = _permute4(data, spec._gnu_to_arr)
 	return data
 
-def dumps(data, spec=Spec()):
+def dumps(data, spec=_DEFAULT_SPEC):
 	''' Dump to string. '''
-	if spec.has_nontrivial_order:
-		import numpy
-		# iterators to lists...
-		data = list(list(list(list(x) for x in x) for x in x) for x in data)
-		data = numpy.transpose(data, spec._arr_to_gnu)
-
-	s = '\n\n\n'.join(
-	      '\n\n'.join(
-	        '\n'.join(
-	          ' '.join(map(str, line))
-	        for line in block)
-	      for block in index_block)
-	    for index_block in data)
-	return s
-
-def loads(s, spec=Spec()):
-	''' Load from string. '''
+	return ''.join(_dump_chunks(data, spec))
+
+def loads(s, spec=_DEFAULT_SPEC):
+	'''
+	Load from string.
+
+	>>> data = [[[[1.0, 2.5], [3.0, -4.0]], [[5.0, 6.0]]], [[[7.0, 1e-20]]]]
+	>>> loads(dumps(data)) == data
+	True
+	>>> spec = Spec().order(gnu='dblw', json='wdbl')
+	>>> data = [[[[1.0, 2.0, 3.0]], [[4.0, 5.0, 6.0]]]]
+	>>> loads(dumps(data, spec=spec), spec=spec) == data
+	True
+	'''
 	from io import StringIO
 	return load(file=StringIO(s), spec=spec)
 
+def _dump_chunks(data, spec):
+	'''
+	Generate the text written by ``dump`` in pieces, one block at a time.
+
+	Arrays are printed the same way as their elements would be by ``str``.
+
+	>>> import numpy
+	>>> ''.join(_dump_chunks(numpy.array([[[[0.1, 2]]]], dtype=numpy.float32), _DEFAULT_SPEC))
+	'0.1 2.0'
+	'''
+	if _is_ndarray(data):
+		# transposing an array only makes a view
+		if spec.has_nontrivial_order():
+			data = data.transpose(spec._arr_to_gnu)
+		# tolist() converts the whole thing to python scalars (which also str()
+		#  faster) in C.  This is only safe for dtypes that python's own types
+		#  print identically; e.g. float32 0.1 would become 0.10000000149011612.
+		if data.dtype.kind in 'iu' or data.dtype == 'float64':
+			data = data.tolist()
+	elif spec.has_nontrivial_order():
+		data = _permute4(data, spec._arr_to_gnu)
+
+	for (i, index_block) in enumerate(data):
+		if i: yield '\n\n\n'
+		for (j, block) in enumerate(index_block):
+			if j: yield '\n\n'
+			yield '\n'.join([' '.join(map(str, line)) for line in block])
+
+def _is_ndarray(x):
+	# (if numpy has not been imported, then x cannot be an array)
+	numpy = sys.modules.get('numpy')
+	return numpy is not None and isinstance(x, numpy.ndarray)
+
+def _permute4(data, perm):
+	'''
+	Pure-python analogue of ``numpy.transpose(data, perm).tolist()``
+	for a quadruply-nested list.
+
+	The permutation is performed as a sequence of adjacent axis swaps,
+	each of which is a single ``zip``.  Any level of the input may be an
+	arbitrary iterable.  Unlike ``tolist()``, the output is not entirely
+	fresh lists: when the innermost axis stays in place, the innermost rows
+	are those of the input (shared, not copied, and tuples stay tuples).
+
+	>>> x = [[[(1, 2), (3, 4)]]]
+	>>> _permute4(x, (0, 2, 1, 3))
+	[[[(1, 2)], [(3, 4)]]]
+	>>> _permute4(x, (0, 2, 1, 3))[0][0][0] is x[0][0][0]
+	True
+
+	>>> _permute4([[[[1.0, 2.0], [3.0, 4.0]]]], (0, 1, 3, 2))
+	[[[[1.0, 3.0], [2.0, 4.0]]]]
+
+	Like numpy, it refuses ragged data.
+
+	>>> _permute4([[[[1.0, 2.0], [3.0]]]], (0, 1, 3, 2))
+	Traceback (most recent call last):
+	    ...
+	ValueError: cannot permute the axes of ragged data
+	'''
+	data = _rectangular_copy(data)
+	axes = [0, 1, 2, 3]
+	for (dest, axis) in enumerate(perm):
+		# bubble the desired axis up to its destination
+		for depth in reversed(range(dest, axes.index(axis))):
+			data = _swap_axes(data, depth)
+			axes[depth], axes[depth+1] = axes[depth+1], axes[depth]
+	return data
+
+def _swap_axes(data, depth):
+	''' Swap axes ``depth`` and ``depth+1`` of a nested list. '''
+	if depth == 0:
+		return [list(x) for x in zip(*data)]
+	return [_swap_axes(x, depth-1) for x in data]
+
+def _rectangular_copy(data):
+	'''
+	Copy the outer levels of a quadruply-nested iterable into lists, checking
+	that it is not ragged (which ``zip`` would silently truncate).
+	Innermost rows that are already lists or tuples are kept as they are.
+	'''
+	seq = lambda x: x if isinstance(x, (list, tuple)) else list(x)
+	data = [[[seq(line) for line in seq(block)] for block in seq(index_block)]
+		for index_block in data]
+
+	blocks = [block for index_block in data for block in index_block]
+	lines = [line for block in blocks for line in block]
+	for level in (data, blocks, lines):
+		if len(set(map(len, level))) > 1:
+			raise ValueError('cannot permute the axes of ragged data')
+	return data
+
 #--------------------------
 # CLI
 
@@ -12,10 +12,14 @@ setup(
 	author = 'Michael Lamparski',
 	author_email = 'lampam@rpi.edu',
 
+	python_requires='>=3.9',
 	install_requires=[
 		'numpy',
 		'scipy',
 	],
+	extras_require={
+		'jit': ['numba'],
+	},
 
 	packages=find_packages(),
 )